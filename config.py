@@ -29,6 +29,10 @@ CONFIG = {
     # For more information, see TRANSFER_MODE.
     "MIN_TRANSFER_TIME_SECONDS": 180,
 
+    # The number of most recent search results kept in memory, so that repeated searches with the same parameters
+    # are answered immediately. If 0, search results are not cached.
+    "SEARCH_CACHE_SIZE": 128,
+
     # If true, the main search function is profiled and the profiling results are saved into profile.prof.
     "PROFILE": False,
 }
@@ -1,8 +1,12 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from datetime import date, datetime, time
+from datetime import date, datetime, time, timedelta
 from functools import cached_property, total_ordering
-from .structures import Route, Stop, StopTime, Transfer, Trip
+from typing import TYPE_CHECKING
+from .structures import StopTime, Transfer, TransferType
+
+if TYPE_CHECKING:
+    from .ui import Ui
 
 
 MIDNIGHT = time(0, 0)
@@ -17,6 +21,8 @@ class TripConnectionSegment:
     The service_day represents a date for which the trip runs, as in trips.txt.
     For example, if the trip was from 0:30 to 1:00 on Tuesday, but the dataset described it as a trip
     on Monday from 24:30 to 25:00, the service_day would be the date for Monday.
+
+    Segments only refer to the trip and stops by their ids, which can be resolved using the Dataset.
     """
 
     start_stoptime: StopTime
@@ -24,28 +30,33 @@ class TripConnectionSegment:
     service_day: date
 
     @property
-    def trip(self) -> Trip:
-        return self.start_stoptime.get_trip()
+    def trip_id(self) -> str:
+        return self.start_stoptime.trip_id
 
     @property
-    def start_stop(self) -> Stop:
-        return self.start_stoptime.get_stop()
+    def start_stop_id(self) -> str:
+        return self.start_stoptime.stop_id
 
     @property
-    def end_stop(self) -> Stop:
-        return self.end_stoptime.get_stop()
+    def end_stop_id(self) -> str:
+        return self.end_stoptime.stop_id
 
     @property
     def start_departure(self) -> datetime:
-        return datetime.combine(self.service_day, MIDNIGHT) + self.start_stoptime.departure_time
+        return datetime.combine(self.service_day, MIDNIGHT) + timedelta(seconds=self.start_stoptime.departure_time)
 
     @property
     def end_arrival(self) -> datetime:
-        return datetime.combine(self.service_day, MIDNIGHT) + self.end_stoptime.arrival_time
+        return datetime.combine(self.service_day, MIDNIGHT) + timedelta(seconds=self.end_stoptime.arrival_time)
 
-    @property
-    def route(self) -> Route:
-        return self.trip.get_route()
+    def display(self, ui: Ui) -> None:
+        """Display this segment to the user as a part of a found connection."""
+        trip = ui.dataset.get_trip_by_id(self.trip_id)
+        start_stop = ui.dataset.get_stop_by_id(self.start_stop_id).stop_name
+        end_stop = ui.dataset.get_stop_by_id(self.end_stop_id).stop_name
+        print(f"\t{trip.get_route().transport_type_str} {trip.get_trip_name()}")
+        print(f"\t\t{ui.format_datetime(self.start_departure)} {start_stop}")
+        print(f"\t\t{ui.format_datetime(self.end_arrival)} {end_stop}")
 
 
 @dataclass
@@ -60,20 +71,16 @@ class OpenTripConnectionSegment:
     service_day: date
 
     @property
-    def trip(self) -> Trip:
-        return self.start_stoptime.get_trip()
+    def trip_id(self) -> str:
+        return self.start_stoptime.trip_id
 
     @property
-    def start_stop(self) -> Stop:
-        return self.start_stoptime.get_stop()
+    def start_stop_id(self) -> str:
+        return self.start_stoptime.stop_id
 
     @property
     def start_departure(self) -> datetime:
-        return datetime.combine(self.service_day, MIDNIGHT) + self.start_stoptime.departure_time
-
-    @property
-    def route(self) -> Route:
-        return self.trip.get_route()
+        return datetime.combine(self.service_day, MIDNIGHT) + timedelta(seconds=self.start_stoptime.departure_time)
 
 
 @dataclass
@@ -91,12 +98,30 @@ class TransferConnectionSegment:
     end_arrival: datetime
 
     @property
-    def start_stop(self) -> Stop:
-        return self.transfer.get_from_stop()
-
-    @property
-    def end_stop(self) -> Stop:
-        return self.transfer.get_to_stop()
+    def start_stop_id(self) -> str:
+        return self.transfer.from_stop_id
+
+    @property
+    def end_stop_id(self) -> str:
+        return self.transfer.to_stop_id
+
+    def display(self, ui: Ui) -> None:
+        """Display this segment to the user as a part of a found connection."""
+        match self.transfer.transfer_type:
+            case TransferType.BY_TRANSFERS_GUARANTEED:
+                print("\tPěší přesun: garantovaný přestup")
+            case TransferType.BY_TRANSFERS_TIMED:
+                minutes, seconds = divmod(self.transfer.transfer_time, 60)
+                if minutes == 0 and seconds == 0:
+                    print("\tPěší přesun")
+                elif minutes == 0 and seconds != 0:
+                    print(f"\tPěší přesun: cca {seconds} s")
+                elif seconds == 0:
+                    print(f"\tPěší přesun: cca {minutes} min")
+                else:
+                    print(f"\tPěší přesun: cca {minutes} min {seconds} s")
+            case _:
+                print("\tPěší přesun")
 
 
 @total_ordering
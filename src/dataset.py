@@ -2,31 +2,37 @@ from __future__ import annotations
 from abc import abstractmethod
 from collections import defaultdict
 from csv import DictReader
-from datetime import date, timedelta
-from functools import cache
+from datetime import date
 from os.path import isfile
+from sys import intern
 from typing import Any, Callable, Iterable, Protocol, Self, overload
 
 from .structures import (
-    CalendarDatesRecord, CalendarRecord, LocationType, PickupDropoffType,
-    Route, RouteType, Stop, StopTime, Transfer, TransferType, Trip
+    SECONDS_PER_DAY, CalendarDatesRecord, CalendarRecord, FeedInfo, LocationType, PickupDropoffType, Route,
+    RouteType, ServiceCalendar, Stop, StopDepartures, StopTime, Transfer, TransferType, Trip, TripStopTimes
 )
 
 
+# The maximum number of days for which the service days are expanded into sets when loading the dataset
+# (days outside of them are checked against the ServiceCalendars, which is slower, but needs no memory)
+MAX_EXPANDED_SERVICE_DAYS = 400
+
+
 class Dataset:
     """An interface with the GTFS dataset."""
 
     config: dict[str, Any]
+    _transfer_node_id_field: str | None
     _stops_by_id: dict[str, Stop]
-    _stops_by_transfer_node_id: defaultdict[str, list[Stop]] = defaultdict()
-    _stops_by_parent_station: defaultdict[str, list[Stop]] = defaultdict()
-    _transfers_by_origin_stop_id: defaultdict[str, list[Transfer]] = defaultdict()
+    _stops_by_transfer_group: dict[str, tuple[Stop, ...]]
+    _transfers_by_stop_id: dict[str, tuple[Transfer, ...]]
     _routes_by_id: dict[str, Route]
     _trips_by_id: dict[str, Trip]
-    _stop_times_by_trip: defaultdict[str, list[StopTime]]
-    _stop_times_by_stop: defaultdict[str, list[StopTime]]
-    _calendar_by_service_id: dict[str, CalendarRecord]
-    _calendar_dates_by_service_id: dict[tuple[str, date], CalendarDatesRecord]
+    _stop_times_by_trip: dict[str, TripStopTimes]
+    _departures_by_stop: dict[str, StopDepartures]
+    _service_calendars_by_service_id: dict[str, ServiceCalendar]
+    _service_days_by_service_id: dict[str, frozenset[int]]
+    _fully_expanded_days: range
 
     def __init__(self, config: dict[str, Any]) -> None:
         """
@@ -37,18 +43,25 @@ class Dataset:
         """
 
         self.config = config
+        # The field used as the transfer node id, or None if TRANSFER_MODE is not by_node_id
+        self._transfer_node_id_field = config["TRANSFER_NODE_ID"] if config["TRANSFER_MODE"] == "by_node_id" else None
 
         stops = self._read_csv_file("stops", self._to_stop)
         self._stops_by_id = self._index_by(stops, lambda stop: stop.stop_id)
 
+        # Transfers by node id or parent station are created lazily in get_all_transfers_from()
+        self._stops_by_transfer_group = {}
+        self._transfers_by_stop_id = {}
         match config["TRANSFER_MODE"]:
             case "by_node_id":
-                self._stops_by_transfer_node_id = self._group_by(stops, lambda stop: stop.transfer_node_id)
+                self._stops_by_transfer_group = self._pack_groups(self._group_by(stops, lambda stop: stop.transfer_node_id))
             case "by_parent_station":
-                self._stops_by_parent_station = self._group_by(stops, lambda stop: stop.parent_station)
+                self._stops_by_transfer_group = self._pack_groups(self._group_by(stops, lambda stop: stop.parent_station))
             case "by_transfers_txt":
                 transfers = self._read_csv_file("transfers", self._to_transfer)
-                self._transfers_by_origin_stop_id = self._group_by(transfers, lambda transfer: transfer.from_stop_id)
+                self._transfers_by_stop_id = self._pack_groups(
+                    self._group_by(transfers, lambda transfer: transfer.from_stop_id)
+                )
 
         routes = self._read_csv_file("routes", self._to_route)
         self._routes_by_id = self._index_by(routes, lambda route: route.route_id)
@@ -56,19 +69,35 @@ class Dataset:
         trips = self._read_csv_file("trips", self._to_trip)
         self._trips_by_id = self._index_by(trips, lambda trip: trip.trip_id)
 
-        stop_times = self._read_csv_file("stop_times", self._to_stop_time)
-        self._stop_times_by_trip = self._group_by(
-            stop_times, lambda stop_time: stop_time.trip_id, lambda stop_time: stop_time.stop_sequence
-        )
-        self._stop_times_by_stop = self._group_by(
-            stop_times, lambda stop_time: stop_time.stop_id, lambda stop_time: stop_time.departure_time % timedelta(days=1)
-        )
-
+        # The service days are needed before stop_times.txt, because they are copied into the StopDepartures tables
         calendar = self._read_optional_csv_file("calendar", self._to_calendar_record)
-        self._calendar_by_service_id = self._index_by(calendar, lambda record: record.service_id)
-
         calendar_dates = self._read_optional_csv_file("calendar_dates", self._to_calendar_dates_record)
-        self._calendar_dates_by_service_id = self._index_by(calendar_dates, lambda record: (record.service_id, record.date))
+        feed_info = self._read_optional_csv_file("feed_info", self._to_feed_info)
+        self._service_calendars_by_service_id = self._to_service_calendars(calendar, calendar_dates)
+        expanded_days = self._find_expanded_days(feed_info, calendar, calendar_dates)
+        self._service_days_by_service_id = {
+            service_id: frozenset(day for day in expanded_days if day in service_calendar)
+            for service_id, service_calendar in self._service_calendars_by_service_id.items()
+        }
+
+        stop_times = self._read_csv_file("stop_times", self._to_stop_time)
+        self._stop_times_by_trip = {
+            trip_id: self._to_trip_stop_times(trip_stop_times)
+            for trip_id, trip_stop_times in self._group_by(
+                stop_times, lambda stop_time: stop_time.trip_id, lambda stop_time: stop_time.stop_sequence
+            ).items()
+        }
+        # Departures which passengers cannot get on are never used by the search, so they are left out of the tables
+        departures = [stop_time for stop_time in stop_times if stop_time.pickup_type != PickupDropoffType.NOT_AVAILABLE]
+        self._departures_by_stop = {
+            stop_id: self._to_stop_departures(stop_stop_times)
+            for stop_id, stop_stop_times in self._group_by(
+                departures, lambda stop_time: stop_time.stop_id, lambda stop_time: stop_time.departure_time % SECONDS_PER_DAY
+            ).items()
+        }
+        # Departures more than 24 hours after midnight belong to service days before the day on which they happen
+        max_days_after_service_day = max((stop_time.departure_time for stop_time in departures), default=0) // SECONDS_PER_DAY
+        self._fully_expanded_days = range(expanded_days.start + max_days_after_service_day, expanded_days.stop - 1)
 
     def _read_csv_file[T](self, name: str, to_object: Callable[[dict[str, str]], T | None]) -> list[T]:
         """
@@ -142,17 +171,113 @@ class Dataset:
                 lst.sort(key=get_inner_sort_key)
         return new_table
 
+    def _pack_groups[T, I](self, groups: dict[I, list[T]]) -> dict[I, tuple[T, ...]]:
+        """
+        Convert the groups returned by _group_by() into tuples, which are immutable and take up only as much
+        memory as their contents need. The returned dict is a plain dict, so missing indices raise KeyError
+        and must be looked up with .get().
+        """
+        return {idx: tuple(group) for idx, group in groups.items()}
+
+    def _to_trip_stop_times(self, stop_times: list[StopTime]) -> TripStopTimes:
+        """Convert a list of StopTimes on a single trip (ordered by stop_sequence) to a TripStopTimes table."""
+        return TripStopTimes(
+            stop_times=tuple(stop_times),
+            stop_sequences=tuple(stop_time.stop_sequence for stop_time in stop_times),
+            arrival_times=tuple(stop_time.arrival_time for stop_time in stop_times),
+            drop_off_types=tuple(stop_time.drop_off_type for stop_time in stop_times),
+            stop_ids=tuple(stop_time.stop_id for stop_time in stop_times),
+        )
+
+    def _to_stop_departures(self, stop_times: list[StopTime]) -> StopDepartures:
+        """Convert a list of StopTimes at a single stop (ordered by departure time modulo 24 hours) to a StopDepartures table."""
+        return StopDepartures(
+            stop_times=tuple(stop_times),
+            departure_keys=tuple(stop_time.departure_time % SECONDS_PER_DAY for stop_time in stop_times),
+            departure_times=tuple(stop_time.departure_time for stop_time in stop_times),
+            service_days=tuple(
+                self.get_service_days(self._trips_by_id[stop_time.trip_id].service_id) for stop_time in stop_times
+            ),
+            service_calendars=tuple(
+                self.get_service_calendar(self._trips_by_id[stop_time.trip_id].service_id) for stop_time in stop_times
+            ),
+        )
+
+    def _to_service_calendars(
+        self, calendar: list[CalendarRecord], calendar_dates: list[CalendarDatesRecord]
+    ) -> dict[str, ServiceCalendar]:
+        """
+        Combine the records from calendar.txt and calendar_dates.txt into a ServiceCalendar for every service_id.
+
+        Parameters:
+        :param calendar: The records from calendar.txt, describing the regular weekly schedules.
+        :param calendar_dates: The records from calendar_dates.txt, describing exceptions to the weekly schedules.
+        """
+
+        calendar_by_service_id = self._index_by(calendar, lambda calendar_record: calendar_record.service_id)
+        added_days: defaultdict[str, set[int]] = defaultdict(set)
+        removed_days: defaultdict[str, set[int]] = defaultdict(set)
+        for calendar_dates_record in calendar_dates:
+            days = added_days if calendar_dates_record.service_available else removed_days
+            days[calendar_dates_record.service_id].add(calendar_dates_record.date.toordinal())
+        return {
+            service_id: ServiceCalendar(
+                calendar_record=calendar_by_service_id.get(service_id),
+                added_days=frozenset(added_days.get(service_id, ())),
+                removed_days=frozenset(removed_days.get(service_id, ())),
+            )
+            for service_id in calendar_by_service_id.keys() | added_days.keys() | removed_days.keys()
+        }
+
+    def _find_expanded_days(
+        self, feed_info: list[FeedInfo], calendar: list[CalendarRecord], calendar_dates: list[CalendarDatesRecord]
+    ) -> range:
+        """
+        Find the days (as ordinal numbers, see date.toordinal()) for which the service days are expanded into sets,
+        so that checking whether a service runs on one of them is a single set lookup.
+
+        These are the days for which the dataset provides schedule information - the period in feed_info.txt or,
+        if it is not specified, the period covered by calendar_dates.txt. If neither is available, the expanded days
+        start at the latest start_date in calendar.txt. The calendars themselves are not used for the end, because
+        they are often published as open-ended. At most MAX_EXPANDED_SERVICE_DAYS days are expanded.
+
+        Parameters:
+        :param feed_info: The records from feed_info.txt (at most one).
+        :param calendar: The records from calendar.txt, describing the regular weekly schedules.
+        :param calendar_dates: The records from calendar_dates.txt, describing exceptions to the weekly schedules.
+        """
+
+        exception_days = [calendar_dates_record.date.toordinal() for calendar_dates_record in calendar_dates]
+        feed_start_date = feed_info[0].feed_start_date if feed_info else None
+        feed_end_date = feed_info[0].feed_end_date if feed_info else None
+
+        if feed_start_date is not None:
+            first_day = feed_start_date.toordinal()
+        elif exception_days:
+            first_day = min(exception_days)
+        elif calendar:
+            first_day = max(calendar_record.start_date for calendar_record in calendar).toordinal()
+        else:
+            return range(0)
+
+        last_day = first_day + MAX_EXPANDED_SERVICE_DAYS - 1
+        if feed_end_date is not None:
+            last_day = min(last_day, feed_end_date.toordinal())
+        elif exception_days:
+            last_day = min(last_day, max(exception_days))
+        return range(first_day, last_day + 1)
+
     def _to_stop(self, row: dict[str, str]) -> Stop:
         """Convert a dictionary obtained from a CSV row to a Stop object."""
         return Stop(
             _dataset=self,
-            stop_id=row["stop_id"],
+            stop_id=intern(row["stop_id"]),
             stop_name=_get_or_default(row, "stop_name", None),
             location_type=_get_or_default(row, "location_type", LocationType.STOP_OR_PLATFORM, LocationType.from_field),
-            parent_station=_get_or_default(row, "parent_station", None),
+            parent_station=_get_or_default(row, "parent_station", None, intern),
             transfer_node_id=(
-                None if self.config["TRANSFER_MODE"] != "by_node_id"
-                else _get_or_default(row, self.config["TRANSFER_NODE_ID"], None)
+                None if self._transfer_node_id_field is None
+                else _get_or_default(row, self._transfer_node_id_field, None, intern)
             ),
         )
 
@@ -160,7 +285,7 @@ class Dataset:
         """Convert a dictionary obtained from a CSV row to a Route object."""
         return Route(
             _dataset=self,
-            route_id=row["route_id"],
+            route_id=intern(row["route_id"]),
             route_short_name=_get_or_default(row, "route_short_name", None),
             route_long_name=_get_or_default(row, "route_long_name", None),
             route_type=RouteType.from_field(row["route_type"]),
@@ -170,21 +295,20 @@ class Dataset:
         """Convert a dictionary obtained from a CSV row to a Trip object."""
         return Trip(
             _dataset=self,
-            trip_id=row["trip_id"],
-            route_id=row["route_id"],
-            service_id=row["service_id"],
+            trip_id=intern(row["trip_id"]),
+            route_id=intern(row["route_id"]),
+            service_id=intern(row["service_id"]),
             trip_short_name=_get_or_default(row, "trip_short_name", None),
         )
 
     def _to_stop_time(self, row: dict[str, str]) -> StopTime:
         """Convert a dictionary obtained from a CSV row to a StopTime object."""
         return StopTime(
-            _dataset=self,
-            trip_id=row["trip_id"],
+            trip_id=intern(row["trip_id"]),
             stop_sequence=int(row["stop_sequence"]),
             arrival_time=_parse_time(row["arrival_time"]),
             departure_time=_parse_time(row["departure_time"]),
-            stop_id=row["stop_id"],
+            stop_id=intern(row["stop_id"]),
             pickup_type=_get_or_default(row, "pickup_type", PickupDropoffType.REGULAR, PickupDropoffType.from_field),
             drop_off_type=_get_or_default(row, "drop_off_type", PickupDropoffType.REGULAR, PickupDropoffType.from_field),
         )
@@ -192,8 +316,7 @@ class Dataset:
     def _to_calendar_record(self, row: dict[str, str]) -> CalendarRecord:
         """Convert a dictionary obtained from a CSV row to a CalendarRecord object."""
         return CalendarRecord(
-            _dataset=self,
-            service_id=row["service_id"],
+            service_id=intern(row["service_id"]),
             weekday_services={i: bool(int(row[day])) for i, day in enumerate((
                 "monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"
             ))},
@@ -204,12 +327,18 @@ class Dataset:
     def _to_calendar_dates_record(self, row: dict[str, str]) -> CalendarDatesRecord:
         """Convert a dictionary obtained from a CSV row to a CalendarDatesRecord object."""
         return CalendarDatesRecord(
-            _dataset=self,
-            service_id=row["service_id"],
+            service_id=intern(row["service_id"]),
             date=_parse_date(row["date"]),
             service_available=(row["exception_type"] == "1"),
         )
 
+    def _to_feed_info(self, row: dict[str, str]) -> FeedInfo:
+        """Convert a dictionary obtained from a CSV row to a FeedInfo object."""
+        return FeedInfo(
+            feed_start_date=_get_or_default(row, "feed_start_date", None, _parse_date),
+            feed_end_date=_get_or_default(row, "feed_end_date", None, _parse_date),
+        )
+
     def _to_transfer(self, row: dict[str, str]) -> Transfer | None:
         """Convert a dictionary obtained from a CSV row to a Transfer object, or None for an unsupported transfer."""
         for unsupported_header in ("from_trip_id", "to_trip_id", "from_route_id", "to_route_id"):
@@ -220,9 +349,8 @@ class Dataset:
             _get_or_default(row, "min_transfer_time", self.config["MIN_TRANSFER_TIME_SECONDS"], int)
         )
         return Transfer(
-            _dataset=self,
-            from_stop_id=row["from_stop_id"],
-            to_stop_id=row["to_stop_id"],
+            from_stop_id=intern(row["from_stop_id"]),
+            to_stop_id=intern(row["to_stop_id"]),
             transfer_type=_get_or_default(row, "transfer_type", TransferType.BY_TRANSFERS_UNTIMED, TransferType.from_field),
             transfer_time=transfer_time,
         )
@@ -231,41 +359,40 @@ class Dataset:
         """Get a Stop object from the dataset by its stop_id."""
         return self._stops_by_id[stop_id]
 
-    def get_all_transfers_from(self, stop: Stop) -> Iterable[Transfer]:
+    def get_all_transfers_from(self, stop: Stop) -> tuple[Transfer, ...]:
         """
         Get all transfers from the dataset by the stop they start on.
 
-        The transfer lookup depends on the "TRANSFER_MODE" value of the configuration.
+        The transfer lookup depends on the "TRANSFER_MODE" value of the configuration. Transfers from transfers.txt
+        are loaded with the dataset, other transfers are created on the first call for each stop and then cached.
+        """
+
+        transfers = self._transfers_by_stop_id.get(stop.stop_id)
+        if transfers is None:
+            transfers = self._transfers_by_stop_id[stop.stop_id] = self._create_transfers_from(stop)
+        return transfers
+
+    def _create_transfers_from(self, stop: Stop) -> tuple[Transfer, ...]:
+        """
+        Create transfers from a stop to all other stops in the same transfer group, i.e. with the same transfer node id
+        (if "TRANSFER_MODE" is "by_node_id") or the same parent station (if "TRANSFER_MODE" is "by_parent_station").
         """
 
         match self.config["TRANSFER_MODE"]:
             case "by_node_id":
-                if stop.transfer_node_id is None:
-                    return []
-                return (Transfer(
-                    _dataset=self,
-                    from_stop_id=stop.stop_id,
-                    to_stop_id=target_stop.stop_id,
-                    transfer_type=TransferType.BY_NODE_ID,
-                    transfer_time=self.config["MIN_TRANSFER_TIME_SECONDS"],
-                ) for target_stop in self._stops_by_transfer_node_id[stop.transfer_node_id])
-
+                group, transfer_type = stop.transfer_node_id, TransferType.BY_NODE_ID
             case "by_parent_station":
-                if stop.parent_station is None:
-                    return []
-                return (Transfer(
-                    _dataset=self,
-                    from_stop_id=stop.stop_id,
-                    to_stop_id=target_stop.stop_id,
-                    transfer_type=TransferType.BY_PARENT_STATION,
-                    transfer_time=self.config["MIN_TRANSFER_TIME_SECONDS"],
-                ) for target_stop in self._stops_by_parent_station[stop.parent_station])
-
-            case "by_transfers_txt":
-                return self._transfers_by_origin_stop_id[stop.stop_id]
-
-            case _: # either "none" or some invalid/unsupported value
-                return []
+                group, transfer_type = stop.parent_station, TransferType.BY_PARENT_STATION
+            case _: # "by_transfers_txt" (with no transfers from this stop), "none" or some invalid/unsupported value
+                return ()
+        if group is None:
+            return ()
+        return tuple(Transfer(
+            from_stop_id=stop.stop_id,
+            to_stop_id=target_stop.stop_id,
+            transfer_type=transfer_type,
+            transfer_time=self.config["MIN_TRANSFER_TIME_SECONDS"],
+        ) for target_stop in self._stops_by_transfer_group[group] if target_stop.stop_id != stop.stop_id)
 
     def get_route_by_id(self, route_id: str) -> Route:
         """Get a Route object from the dataset by its route_id."""
@@ -275,26 +402,35 @@ class Dataset:
         """Get a Trip object from the dataset by its trip_id."""
         return self._trips_by_id[trip_id]
 
-    def get_stop_times_by_trip_id(self, trip_id: str) -> list[StopTime]:
-        """Get a list of StopTimes occurring on the specified trip."""
-        return self._stop_times_by_trip[trip_id]
+    def get_stop_times_by_trip_id(self, trip_id: str) -> TripStopTimes:
+        """Get a table of StopTimes occurring on the specified trip."""
+        stop_times = self._stop_times_by_trip.get(trip_id)
+        return stop_times if stop_times is not None else TripStopTimes.empty()
 
-    def get_stop_times_by_stop_id(self, stop_id: str) -> list[StopTime]:
-        """Get a list of StopTimes occurring at the specified stop."""
-        return self._stop_times_by_stop[stop_id]
+    def get_departures_by_stop_id(self, stop_id: str) -> StopDepartures:
+        """Get a table of StopTimes occurring at the specified stop, leaving out those which passengers cannot get on."""
+        departures = self._departures_by_stop.get(stop_id)
+        return departures if departures is not None else StopDepartures.empty()
 
-    @cache
-    def runs_on_day(self, service_id: str, service_day: date) -> bool:
-        """Return True if the specified service_id runs on the specified service_date and False otherwise."""
-        if (service_id, service_day) in self._calendar_dates_by_service_id:
-            return self._calendar_dates_by_service_id[service_id, service_day].service_available
-        else:
-            calendar_record = self._calendar_by_service_id[service_id]
-            return (
-                service_day >= calendar_record.start_date and
-                service_day <= calendar_record.end_date and
-                calendar_record.weekday_services[service_day.weekday()]
-            )
+    def get_service_days(self, service_id: str) -> frozenset[int]:
+        """
+        Get a set of all service days (as ordinal numbers, see date.toordinal()) on which the specified service_id runs,
+        limited to the days expanded when loading the dataset.
+        """
+        return self._service_days_by_service_id.get(service_id, frozenset())
+
+    def get_service_calendar(self, service_id: str) -> ServiceCalendar:
+        """Get a ServiceCalendar describing all days on which the specified service_id runs."""
+        service_calendar = self._service_calendars_by_service_id.get(service_id)
+        return service_calendar if service_calendar is not None else ServiceCalendar(None, frozenset(), frozenset())
+
+    def has_expanded_service_days(self, day: int) -> bool:
+        """
+        Return True if get_service_days() covers every service day of departures happening on the specified day
+        (as an ordinal number, see date.toordinal()) and the day after it. Otherwise, the service days need to be checked
+        with get_service_calendar().
+        """
+        return day in self._fully_expanded_days
 
     def get_all_stop_ids_and_names(self) -> Iterable[tuple[str, str]]:
         """For every stop (location_type=0) in the dataset, return a tuple (stop_id, stop_name)."""
@@ -331,10 +467,10 @@ def _get_or_default[T](row: dict[str, str], key: str, default: str | T, mapping:
         return default
 
 
-def _parse_time(time_str: str) -> timedelta:
-    """Parse a time string in HH:MM:SS or H:MM:SS format."""
+def _parse_time(time_str: str) -> int:
+    """Parse a time string in HH:MM:SS or H:MM:SS format into the number of seconds since midnight."""
     h, m, s = map(int, time_str.split(":"))
-    return timedelta(hours=h, minutes=m, seconds=s)
+    return h * 3600 + m * 60 + s
 
 def _parse_date(date_str: str) -> date:
     """Parse a date string in YYYYMMDD format."""
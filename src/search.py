@@ -1,20 +1,25 @@
 from dataclasses import dataclass
-from datetime import datetime, timedelta
-from queue import PriorityQueue
+from datetime import datetime
+from heapq import heappop, heappush, heapreplace
+from itertools import count
 
 from .dataset import Dataset
+from .structures import datetime_to_seconds
 from .visitor import StopVisitor, TransferVisitor, Visitor
 from .connection import Connection, OpenConnection
 
 
-@dataclass
+@dataclass(frozen=True)
 class SearchParams:
-    """Represents all the parameters the user can set when searching for a connection."""
+    """
+    Represents all the parameters the user can set when searching for a connection.
+    SearchParams are immutable and hashable, so they can be used as a key when caching search results.
+    """
 
-    origin_stop_ids: list[str]
-    """A list of stop_ids for all stops where the connection can possibly start."""
-    destination_stop_ids: list[str]
-    """A list of stop_ids for all stops where the connection can possibly end."""
+    origin_stop_ids: tuple[str, ...]
+    """A tuple of stop_ids for all stops where the connection can possibly start."""
+    destination_stop_ids: tuple[str, ...]
+    """A tuple of stop_ids for all stops where the connection can possibly end."""
     departure: datetime
     """The datetime at or after which to search for the connection."""
 
@@ -34,50 +39,75 @@ def search(params: SearchParams, dataset: Dataset) -> SearchResult:
     """
     Perform the search algorithm with the specified parameters on the specified dataset and return its results.
 
-    Keep a priority queue with all the Visitors ordered by their next event and dictionaries of the best connections
-    to stops and trips that were found so far. For each of the origin stops, enqueue its StopVisitor and also all
-    TransferVisitors for its transfers. Then, in the main loop, dequeue the next Visitor. If its time is different
-    from the previous one, check if a connection was found or the time limit was passed. Then call next() on the Visitor
-    and enqueue all new Visitors returned by the call. If the queue is empty, no connection exists.
+    Keep a priority queue (a heap) with all the Visitors ordered by their next event and dictionaries of the best
+    connections to stops and trips that were found so far. For each of the origin stops, enqueue its StopVisitor and
+    also all TransferVisitors for its transfers. Then, in the main loop, take the next Visitor from the top of the heap.
+    If its time is different from the previous one, check if a connection was found or the time limit was passed.
+    Then call next() on the Visitor, which advances it to its following event. If it has one, the Visitor is moved
+    to its new place in the heap in a single operation, otherwise it is removed. Finally, enqueue all new Visitors
+    returned by the call. The best connection to any of the destinations is kept updated whenever a Visitor arrives
+    at a destination stop. Visitors whose next event is past the time limit (or, once a destination has been reached,
+    past the current time) are never dequeued, so they are not enqueued at all. If the queue is empty or the time limit
+    is passed, the best connection found so far is returned (None if no connection was found).
+
+    The heap holds tuples (event_time, event_priority, order, visitor), so that it is ordered by plain integer
+    comparisons. Events at the same time are handled by their event_priority - arrivals before departures, so that
+    a departure in the same second as an arrival to its stop can use the connection it brought. The order is a unique
+    increasing number, which keeps the remaining ties in the order they were enqueued and ensures the visitors
+    themselves are never compared.
     """
 
-    queue: PriorityQueue[Visitor] = PriorityQueue()
+    queue: list[tuple[int, int, int, Visitor]] = []
+    order = count()
     visited_stops: dict[str, Connection] = {}
     visited_trips: dict[str, OpenConnection] = {}
-    time_limit = params.departure + timedelta(hours=dataset.config["MAX_SEARCH_TIME_HOURS"])
-    destinations = params.destination_stop_ids
+    departure = datetime_to_seconds(params.departure)
+    time_limit = departure + dataset.config["MAX_SEARCH_TIME_HOURS"] * 3600
+    destinations = set(params.destination_stop_ids)
+    best_so_far: Connection | None = None
 
     for origin_stop_id in params.origin_stop_ids:
         # Create StopVisitor at the origin stop
-        origin_visitor = StopVisitor.create_at_origin(dataset, origin_stop_id, params.departure)
+        origin_visitor = StopVisitor.create_at_origin(dataset, origin_stop_id, departure)
         if origin_visitor is not None:
-            queue.put(origin_visitor)
+            heappush(queue, (origin_visitor.event_time, origin_visitor.event_priority, next(order), origin_visitor))
             visited_stops[origin_stop_id] = Connection.empty()
+            if origin_stop_id in destinations:
+                best_so_far = visited_stops[origin_stop_id]
 
         # Create TransferVisitors for transfers directly from the origin stop
         for transfer_visitor in TransferVisitor.create_all(
-            dataset.get_stop_by_id(origin_stop_id), params.departure, Connection.empty()
+            dataset, dataset.get_stop_by_id(origin_stop_id), departure, Connection.empty(), visited_stops, time_limit
         ):
             if transfer_visitor.transfer.to_stop_id not in params.origin_stop_ids:
-                queue.put(transfer_visitor)
+                heappush(queue, (transfer_visitor.event_time, transfer_visitor.event_priority, next(order), transfer_visitor))
 
-    previous_time = params.departure
-    while not queue.empty():
-        visitor = queue.get()
-        if visitor.next_event() > previous_time:
+    previous_time = departure
+    while queue:
+        event_time, _, _, visitor = queue[0]
+        if event_time > previous_time:
             # Time has incremented, check if we have found a connection or passed the time limit
-            previous_time = visitor.next_event()
-            found_connections: list[Connection] = []
-            for destination in destinations:
-                if destination in visited_stops:
-                    found_connections.append(visited_stops[destination])
-            if found_connections:
-                best_connection = max(found_connections, key=lambda conn: conn.quality)
-                return SearchResult(connection=best_connection)
+            previous_time = event_time
+            if best_so_far is not None:
+                return SearchResult(connection=best_so_far)
             if previous_time > time_limit:
-                break
-        new_visitors = visitor.next(visited_stops, visited_trips)
+                return SearchResult(connection=None)
+        arrival_stop_id = visitor.arrival_stop_id()
+        # The search ends at the next time increment if a connection was found, or after the time limit otherwise
+        cutoff = previous_time if best_so_far is not None else time_limit
+        alive, new_visitors = visitor.next(visited_stops, visited_trips, cutoff)
+        if arrival_stop_id in destinations and arrival_stop_id in visited_stops:
+            # A destination may have been reached (or reached by a better connection)
+            connection = visited_stops[arrival_stop_id]
+            if best_so_far is None or connection.quality > best_so_far.quality:
+                best_so_far = connection
+                cutoff = previous_time
+        if alive and visitor.event_time <= cutoff:
+            heapreplace(queue, (visitor.event_time, visitor.event_priority, next(order), visitor))
+        else:
+            heappop(queue)
         for new_visitor in new_visitors:
-            queue.put(new_visitor)
+            if new_visitor.event_time <= cutoff:
+                heappush(queue, (new_visitor.event_time, new_visitor.event_priority, next(order), new_visitor))
 
-    return SearchResult(connection=None)
+    return SearchResult(connection=best_so_far)
@@ -1,18 +1,35 @@
 from __future__ import annotations
 from dataclasses import dataclass, field
-from datetime import date, timedelta
-from enum import Enum
-from typing import TYPE_CHECKING, Iterable
+from datetime import date, datetime, timedelta
+from enum import IntEnum
+from typing import TYPE_CHECKING
 
 if TYPE_CHECKING:
     from .dataset import Dataset
 
 
+SECONDS_PER_DAY = 24 * 60 * 60
+
+
+def datetime_to_seconds(dt: datetime) -> int:
+    """
+    Convert a datetime to a single number of whole seconds, with days counted by date.toordinal().
+    The search algorithm handles all times in this form.
+    """
+    return dt.toordinal() * SECONDS_PER_DAY + dt.hour * 3600 + dt.minute * 60 + dt.second
+
+
+def seconds_to_datetime(seconds: int) -> datetime:
+    """Convert a number of seconds returned by datetime_to_seconds() back to a datetime."""
+    days, seconds = divmod(seconds, SECONDS_PER_DAY)
+    return datetime.fromordinal(days) + timedelta(seconds=seconds)
+
+
 class MalformedGTFSError(Exception):
     """An exception signifying that the GTFS dataset does not comply with the specification."""
 
 
-class LocationType(Enum):
+class LocationType(IntEnum):
     """
     An enumeration for the stops.location_type field.
 
@@ -37,7 +54,7 @@ class LocationType(Enum):
             raise MalformedGTFSError("stops.location_type not in valid range")
 
 
-@dataclass
+@dataclass(slots=True)
 class Stop:
     """
     A single record in the stops.txt file in the GTFS dataset.
@@ -53,7 +70,7 @@ class Stop:
     parent_station: str | None
     transfer_node_id: str | None
 
-    def get_all_transfers(self) -> Iterable[Transfer]:
+    def get_all_transfers(self) -> tuple[Transfer, ...]:
         """
         Return all transfers that originate at this stop.
 
@@ -61,12 +78,12 @@ class Stop:
         """
         return self._dataset.get_all_transfers_from(self)
 
-    def get_departures(self) -> list[StopTime]:
-        """Return a list of all StopTimes that occur at this stop."""
-        return self._dataset.get_stop_times_by_stop_id(self.stop_id)
+    def get_departures(self) -> StopDepartures:
+        """Return a table of all StopTimes at this stop which passengers can get on."""
+        return self._dataset.get_departures_by_stop_id(self.stop_id)
 
 
-class RouteType(Enum):
+class RouteType(IntEnum):
     """
     An enumeration for the routes.route_type field.
 
@@ -121,26 +138,27 @@ class RouteType(Enum):
 
     def __str__(self) -> str:
         """Get a string representation of this route type."""
-        match self:
-            case RouteType.TRAM_LIGHT_RAIL | RouteType.CABLE_TRAM:
-                return "tramvaj"
-            case RouteType.METRO_SUBWAY:
-                return "metro"
-            case RouteType.RAIL | RouteType.MONORAIL:
-                return "vlak"
-            case RouteType.BUS:
-                return "autobus"
-            case RouteType.FERRY:
-                return "přívoz"
-            case RouteType.AERIAL_LIFT | RouteType.FUNICULAR:
-                return "lanová dráha"
-            case RouteType.TROLLEYBUS:
-                return "trolejbus"
-            case _:
-                raise MalformedGTFSError("routes.route_type not in valid range")
-
-
-@dataclass
+        try:
+            return _ROUTE_TYPE_NAMES[self]
+        except KeyError:
+            raise MalformedGTFSError("routes.route_type not in valid range")
+
+
+_ROUTE_TYPE_NAMES: dict[RouteType, str] = {
+    RouteType.TRAM_LIGHT_RAIL: "tramvaj",
+    RouteType.CABLE_TRAM: "tramvaj",
+    RouteType.METRO_SUBWAY: "metro",
+    RouteType.RAIL: "vlak",
+    RouteType.MONORAIL: "vlak",
+    RouteType.BUS: "autobus",
+    RouteType.FERRY: "přívoz",
+    RouteType.AERIAL_LIFT: "lanová dráha",
+    RouteType.FUNICULAR: "lanová dráha",
+    RouteType.TROLLEYBUS: "trolejbus",
+}
+
+
+@dataclass(slots=True)
 class Route:
     """
     A single record in the routes.txt file in the GTFS dataset.
@@ -153,6 +171,17 @@ class Route:
     route_short_name: str | None
     route_long_name: str | None
     route_type: RouteType
+    _full_name: str | None = field(default=None, init=False, repr=False, compare=False)
+    """A cached result of get_route_full_name()."""
+    _transport_type_str: str | None = field(default=None, init=False, repr=False, compare=False)
+    """A cached value of transport_type_str."""
+
+    @property
+    def transport_type_str(self) -> str:
+        """Get a capitalized string representation of the route type of this route. The result is cached."""
+        if self._transport_type_str is None:
+            self._transport_type_str = str(self.route_type).capitalize()
+        return self._transport_type_str
 
     def get_route_short_name(self) -> str:
         """Get a short string representation of this route."""
@@ -163,17 +192,20 @@ class Route:
         raise MalformedGTFSError("both routes.route_short_name and routes.route_long_name are empty")
 
     def get_route_full_name(self) -> str:
-        """Get a full string representation of this route, including its route type."""
-        route_type = str(self.route_type).capitalize()
+        """Get a full string representation of this route, including its route type. The result is cached."""
+        if self._full_name is not None:
+            return self._full_name
+        route_type = self.transport_type_str
         if self.route_short_name is None:
-            return f"{route_type} ({self.route_long_name})"
+            self._full_name = f"{route_type} ({self.route_long_name})"
         elif self.route_long_name is None:
-            return f"{route_type} {self.route_short_name}"
+            self._full_name = f"{route_type} {self.route_short_name}"
         else:
-            return f"{route_type} {self.route_short_name} ({self.route_long_name})"
+            self._full_name = f"{route_type} {self.route_short_name} ({self.route_long_name})"
+        return self._full_name
 
 
-@dataclass
+@dataclass(slots=True)
 class Trip:
     """
     A single record in the trips.txt file in the GTFS dataset.
@@ -186,29 +218,29 @@ class Trip:
     route_id: str
     service_id: str
     trip_short_name: str | None
+    _route: Route | None = field(default=None, init=False, repr=False, compare=False)
+    """A cached result of get_route()."""
 
     def get_trip_name(self) -> str:
         """Get a string representation of this trip (or its route, if this trip does not have one)."""
-        route_short_name = self._dataset.get_route_by_id(self.route_id).get_route_short_name()
+        route_short_name = self.get_route().get_route_short_name()
         if self.trip_short_name is not None:
             return f"{self.trip_short_name} ({route_short_name})"
         else:
             return route_short_name
 
     def get_route(self) -> Route:
-        """Get a Route to which this trip belongs."""
-        return self._dataset.get_route_by_id(self.route_id)
+        """Get a Route to which this trip belongs. The result is cached."""
+        if self._route is None:
+            self._route = self._dataset.get_route_by_id(self.route_id)
+        return self._route
 
-    def get_stop_times(self) -> list[StopTime]:
-        """Return a list of all StopTimes that occur on this trip."""
+    def get_stop_times(self) -> TripStopTimes:
+        """Return a table of all StopTimes that occur on this trip."""
         return self._dataset.get_stop_times_by_trip_id(self.trip_id)
 
-    def runs_on_day(self, service_day: date) -> bool:
-        """Return whether this trip runs on the specified service day."""
-        return self._dataset.runs_on_day(self.service_id, service_day)
-
 
-class PickupDropoffType(Enum):
+class PickupDropoffType(IntEnum):
     """
     An enumeration for the stop_times.pickup_type and stop_times.drop_off_type fields.
 
@@ -231,33 +263,91 @@ class PickupDropoffType(Enum):
             raise MalformedGTFSError("stop_times.pickup_type or stop_times.drop_off_type not in valid range")
 
 
-@dataclass
+@dataclass(slots=True)
 class StopTime:
     """
     A single record in the stop_times.txt file in the GTFS dataset.
 
-    Represents a scheduled time when a trip arrives to and departs from a stop.
+    Represents a scheduled time when a trip arrives to and departs from a stop. The arrival_time and departure_time
+    are stored as the number of seconds since midnight of the service day (and can be 24 hours or more, as in the
+    dataset). Unlike most other records, a StopTime does not keep a reference to its Dataset - the stop and trip
+    it refers to can be obtained by Dataset.get_stop_by_id() and Dataset.get_trip_by_id().
     """
 
-    _dataset: Dataset = field(repr=False)
     trip_id: str
     stop_sequence: int
-    arrival_time: timedelta
-    departure_time: timedelta
+    arrival_time: int
+    departure_time: int
     stop_id: str
     pickup_type: PickupDropoffType
     drop_off_type: PickupDropoffType
 
-    def get_stop(self) -> Stop:
-        """Get a Stop at which this stop time occurs."""
-        return self._dataset.get_stop_by_id(self.stop_id)
 
-    def get_trip(self) -> Trip:
-        """Get a Trip on which this stop time occurs."""
-        return self._dataset.get_trip_by_id(self.trip_id)
+@dataclass(slots=True)
+class TripStopTimes:
+    """
+    All StopTimes occurring on a single trip, ordered by stop_sequence.
+
+    The values needed when following the trip are stored in parallel tuples (all with the same length
+    and order as stop_times), so the scan reads plain values instead of fetching them from every StopTime.
+    """
+
+    stop_times: tuple[StopTime, ...]
+    """The StopTimes themselves."""
+    stop_sequences: tuple[int, ...]
+    """The stop_sequence of every StopTime (the sort key of this table)."""
+    arrival_times: tuple[int, ...]
+    """The arrival_time of every StopTime."""
+    drop_off_types: tuple[PickupDropoffType, ...]
+    """The drop_off_type of every StopTime."""
+    stop_ids: tuple[str, ...]
+    """The stop_id of every StopTime."""
+
+    @classmethod
+    def empty(cls) -> TripStopTimes:
+        """Create and return an empty TripStopTimes table."""
+        return cls((), (), (), (), ())
+
+    def __len__(self) -> int:
+        """Return the number of StopTimes in this table."""
+        return len(self.stop_times)
+
+
+@dataclass(slots=True)
+class StopDepartures:
+    """
+    All StopTimes occurring at a single stop which passengers can get on (pickup_type is not NOT_AVAILABLE),
+    ordered by departure time modulo 24 hours.
+
+    The values needed when scanning the departures are stored in parallel tuples (all with the same length
+    and order as stop_times), so the scan reads plain values instead of fetching them from every StopTime.
+    """
+
+    stop_times: tuple[StopTime, ...]
+    """The StopTimes themselves."""
+    departure_keys: tuple[int, ...]
+    """The departure_time of every StopTime modulo 24 hours (the sort key of this table)."""
+    departure_times: tuple[int, ...]
+    """The departure_time of every StopTime."""
+    service_days: tuple[frozenset[int], ...]
+    """
+    The set of service days (as ordinal numbers) of the trip to which every StopTime belongs, limited to the days
+    expanded when loading the dataset (see Dataset.has_expanded_service_days()).
+    """
+    service_calendars: tuple[ServiceCalendar, ...]
+    """The ServiceCalendar of the trip to which every StopTime belongs, for days outside the expanded service days."""
+
+    @classmethod
+    def empty(cls) -> StopDepartures:
+        """Create and return an empty StopDepartures table."""
+        return cls((), (), (), (), ())
+
+    def __len__(self) -> int:
+        """Return the number of departures in this table."""
+        return len(self.stop_times)
 
 
-@dataclass
+@dataclass(slots=True)
 class CalendarRecord:
     """
     A single record in the calendar.txt file in the GTFS dataset.
@@ -265,14 +355,13 @@ class CalendarRecord:
     Describes a regular weekly schedule for a service that can be referred to by multiple routes.
     """
 
-    _dataset: Dataset = field(repr=False)
     service_id: str
     weekday_services: dict[int, bool]
     start_date: date
     end_date: date
 
 
-@dataclass
+@dataclass(slots=True)
 class CalendarDatesRecord:
     """
     A single record in the calendar_dates.txt file in the GTFS dataset.
@@ -280,13 +369,52 @@ class CalendarDatesRecord:
     Describes an exception to the regular weekly schedule.
     """
 
-    _dataset: Dataset = field(repr=False)
     service_id: str
     date: date
     service_available: bool
 
 
-class TransferType(Enum):
+@dataclass(slots=True)
+class ServiceCalendar:
+    """
+    All days on which a single service runs, combining its record in calendar.txt with its exceptions in calendar_dates.txt.
+
+    Days are passed as ordinal numbers (see date.toordinal()) and checked by the "in" operator.
+    """
+
+    calendar_record: CalendarRecord | None
+    """The regular weekly schedule of the service, or None if it only runs on the added_days."""
+    added_days: frozenset[int]
+    """The days on which the service runs in addition to its weekly schedule."""
+    removed_days: frozenset[int]
+    """The days on which the service does not run, even though its weekly schedule says so."""
+
+    def __contains__(self, day: int) -> bool:
+        """Return True if the service runs on the specified day (an ordinal number) and False otherwise."""
+        if day in self.added_days:
+            return True
+        if day in self.removed_days or self.calendar_record is None:
+            return False
+        return (
+            self.calendar_record.start_date.toordinal() <= day <= self.calendar_record.end_date.toordinal()
+            # The ordinal day 1 (1 January 1) was a Monday, which has the weekday number 0
+            and self.calendar_record.weekday_services[(day - 1) % 7]
+        )
+
+
+@dataclass(slots=True)
+class FeedInfo:
+    """
+    A single record in the feed_info.txt file in the GTFS dataset.
+
+    Only the period for which the dataset provides schedule information is loaded.
+    """
+
+    feed_start_date: date | None
+    feed_end_date: date | None
+
+
+class TransferType(IntEnum):
     """
     An enumeration for the transfers.transfer_type field.
 
@@ -314,25 +442,17 @@ class TransferType(Enum):
             raise MalformedGTFSError("transfers.transfer_type not in valid range")
 
 
-@dataclass
+@dataclass(slots=True)
 class Transfer:
     """
     A single record in the transfers.txt file in the GTFS dataset.
 
     Represents a possible walking connection between two different stops. Can also represent a transfer
-    that is not in transfers.txt - either a transfer by node_id, or by parent_station.
+    that is not in transfers.txt - either a transfer by node_id, or by parent_station. The stops it connects
+    can be obtained by Dataset.get_stop_by_id().
     """
 
-    _dataset: Dataset = field(repr=False)
     from_stop_id: str
     to_stop_id: str
     transfer_type: TransferType
     transfer_time: int
-
-    def get_from_stop(self) -> Stop:
-        """Get a Stop from which this transfer originates."""
-        return self._dataset.get_stop_by_id(self.from_stop_id)
-
-    def get_to_stop(self) -> Stop:
-        """Get a Stop to which this transfer leads."""
-        return self._dataset.get_stop_by_id(self.to_stop_id)
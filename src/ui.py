@@ -1,91 +1,78 @@
 from __future__ import annotations
-from dataclasses import dataclass, field
+from bisect import bisect_left
+from collections import defaultdict
 from datetime import datetime, timedelta
 from dateutil.parser import parse, ParserError
-from typing import Iterable
+from functools import lru_cache
+from typing import Callable, Iterable
 from cProfile import Profile
 
-from .structures import TransferType
-from .connection import TransferConnectionSegment
 from .search import SearchParams, SearchResult, search
 from .dataset import Dataset
 
 
-@dataclass
-class StopTrieNode:
-    """A single node of the StopTrie."""
-
-    stops: dict[str, list[str]] = field(default_factory=dict)
-    """A mapping of full stop names to all stop_ids of stops with this name."""
-    next_letters: dict[str, StopTrieNode] = field(default_factory=dict)
-    """References to all children of this node."""
-
-    def yield_all_stops(self) -> Iterable[tuple[str, list[str]]]:
-        """Get all stops directly in this node and then recursively in children nodes."""
-        for name, ids in self.stops.items():
-            yield name, ids
-        for child in self.next_letters.values():
-            yield from child.yield_all_stops()
-
-
-class StopTrie:
-    """A trie data structure for fast stop name search."""
-
-    root: StopTrieNode
-    """The root node of this trie."""
-
-    def __init__(self) -> None:
-        """Create a new empty StopTrie."""
-        self.root = StopTrieNode()
-
-    @staticmethod
-    def _map_letter(letter: str) -> str:
-        """Map a letter to its canonical form (lowercase with no diacritics)."""
-        MAPPING = {"á": "a", "ä": "a", "č": "c", "ď": "d", "é": "e", "ě": "e", "ë": "e", "í": "i", "ľ": "l", "ň": "n",
-                   "ó": "o", "ö": "o", "ř": "r", "š": "s", "ť": "t", "ú": "u", "ů": "u", "ü": "u", "ý": "y", "ž": "z"}
-        letter = letter.lower()
-        if letter in MAPPING:
-            return MAPPING[letter]
-        else:
-            return letter
-
-    def add_stop(self, stop_name: str, stop_id: str) -> None:
-        """Add a stop with a specified name and id into the trie."""
-        current_node = self.root
-        for letter in stop_name:
-            letter = StopTrie._map_letter(letter)
-            if letter in current_node.next_letters:
-                current_node = current_node.next_letters[letter]
-            else:
-                new_node = StopTrieNode()
-                current_node.next_letters[letter] = new_node
-                current_node = new_node
-        if stop_name in current_node.stops:
-            current_node.stops[stop_name].append(stop_id)
-        else:
-            current_node.stops[stop_name] = [stop_id]
-
-    def _traverse(self, stop_name: str) -> StopTrieNode | None:
-        """Return a node belonging to this stop_name, or None if no such node exists."""
-        current_node = self.root
-        for letter in stop_name:
-            letter = StopTrie._map_letter(letter)
-            if letter in current_node.next_letters:
-                current_node = current_node.next_letters[letter]
-            else:
-                return None
-        return current_node
+# A translation table mapping lowercase letters with diacritics to their canonical form
+_DIACRITICS_TABLE = str.maketrans({
+    "á": "a", "ä": "a", "č": "c", "ď": "d", "é": "e", "ě": "e", "ë": "e", "í": "i", "ľ": "l", "ň": "n",
+    "ó": "o", "ö": "o", "ř": "r", "š": "s", "ť": "t", "ú": "u", "ů": "u", "ü": "u", "ý": "y", "ž": "z",
+})
+
+# Datetime formats that are tried before falling back to the (much slower) dateutil parser
+_DATETIME_FORMATS = ("%d. %m. %Y %H:%M", "%d.%m.%Y %H:%M")
+
+
+def _fold_uncached(name: str) -> str:
+    """Return the canonical form of a stop name or its prefix (lowercase with no diacritics)."""
+    return name.lower().translate(_DIACRITICS_TABLE)
+
+
+# The same as _fold_uncached(), but cached, for prefixes typed repeatedly by the user
+_fold = lru_cache(maxsize=4096)(_fold_uncached)
 
-    def search_by_prefix(self, stop_name_prefix: str) -> Iterable[tuple[str, list[str]]]:
+
+class StopIndex:
+    """
+    A sorted list of stop names for fast stop name search.
+
+    Stop names are sorted by their canonical form (lowercase with no diacritics), so all names starting
+    with a prefix form a contiguous block that can be found by a binary search.
+    """
+
+    _keys: list[str]
+    """Canonical forms of all stop names, sorted."""
+    _entries: list[tuple[str, list[str]]]
+    """Tuples (stop name, stop_ids of all stops with this name), in the same order as _keys."""
+
+    def __init__(self, stops: Iterable[tuple[str, str]]) -> None:
+        """Create a new StopIndex from tuples (stop_id, stop_name)."""
+        ids_by_name: defaultdict[str, list[str]] = defaultdict(list)
+        for stop_id, stop_name in stops:
+            ids_by_name[stop_name].append(stop_id)
+        # Fold all names at once: join them by a character that cannot appear in a stop name, fold the joined string
+        # and split it again. This is equivalent to calling _fold() on every name, but runs in just a few C calls.
+        folded_names = _fold_uncached("\0".join(ids_by_name)).split("\0")
+        sorted_stops = sorted(
+            (folded_name, stop_name, stop_ids)
+            for folded_name, (stop_name, stop_ids) in zip(folded_names, ids_by_name.items(), strict=True)
+        )
+        self._keys = [key for key, _, _ in sorted_stops]
+        self._entries = [(stop_name, stop_ids) for _, stop_name, stop_ids in sorted_stops]
+
+    def search_by_prefix(self, stop_name_prefix: str, limit: int | None = None) -> Iterable[tuple[str, list[str]]]:
         """
-        Return all stops whose name starts with the specified prefix.
+        Return all stops whose name starts with the specified prefix, ordered by name.
 
         For every stop, return a tuple consisting of its name and a list of stop_ids of all stops with this name.
+        If limit is not None, return at most limit stops.
         """
-        prefix_node = self._traverse(stop_name_prefix)
-        if prefix_node is None:
-            return
-        yield from prefix_node.yield_all_stops()
+        key_prefix = _fold(stop_name_prefix)
+        keys = self._keys
+        start = bisect_left(keys, key_prefix)
+        end = len(keys) if limit is None else min(start + limit, len(keys))
+        for i in range(start, end):
+            if not keys[i].startswith(key_prefix):
+                return
+            yield self._entries[i]
 
 
 class Ui:
@@ -93,15 +80,16 @@ class Ui:
 
     dataset: Dataset
     """The dataset used for the connection search."""
-    stop_trie: StopTrie
-    """A trie structure for fast stop name search."""
+    stop_index: StopIndex
+    """A sorted index of stop names for fast stop name search."""
+    cached_search: Callable[[SearchParams, Dataset], SearchResult]
+    """The search function wrapped in an LRU cache of the most recent search results."""
 
     def __init__(self, dataset: Dataset) -> None:
         """Create a new Ui instance with the specified dataset."""
         self.dataset = dataset
-        self.stop_trie = StopTrie()
-        for stop_id, stop_name in dataset.get_all_stop_ids_and_names():
-            self.stop_trie.add_stop(stop_name, stop_id)
+        self.stop_index = StopIndex(dataset.get_all_stop_ids_and_names())
+        self.cached_search = lru_cache(maxsize=dataset.config["SEARCH_CACHE_SIZE"])(search)
 
     def run(self) -> None:
         """
@@ -122,7 +110,7 @@ class Ui:
                     result = search(params, self.dataset)
                 prof.dump_stats("profile.prof")
             else:
-                result = search(params, self.dataset)
+                result = self.cached_search(params, self.dataset)
             print("Vyhledávání dokončeno.")
             print()
             self._display_result(result)
@@ -143,11 +131,11 @@ class Ui:
             )
             print("Vyhledat spojení:")
             print(f"\t{origin_name} -> {destination_name}")
-            print(f"\tOdjezd: {self._format_datetime(departure)}")
+            print(f"\tOdjezd: {self.format_datetime(departure)}")
             print("[Enter] pro potvrzení, [0] pro nové vyhledání")
             command = input().strip()
             if command == "":
-                return SearchParams(origin_ids, destination_ids, departure)
+                return SearchParams(tuple(origin_ids), tuple(destination_ids), departure)
             elif command != "0":
                 print("Neznámý příkaz. Zkuste vyhledávat znovu.")
     
@@ -173,32 +161,7 @@ class Ui:
         print(f"Spojení: {transfer_count_str}, celkem {self._format_timedelta(total_time)}")
 
         for segment in result.connection.segments:
-            start_stop = segment.start_stop.stop_name
-            start_departure = self._format_datetime(segment.start_departure)
-            end_stop = segment.end_stop.stop_name
-            end_arrival = self._format_datetime(segment.end_arrival)
-            if isinstance(segment, TransferConnectionSegment):
-                match segment.transfer.transfer_type:
-                    case TransferType.BY_TRANSFERS_GUARANTEED:
-                        print("\tPěší přesun: garantovaný přestup")
-                    case TransferType.BY_TRANSFERS_TIMED:
-                        minutes, seconds = divmod(segment.transfer.transfer_time, 60)
-                        if minutes == 0 and seconds == 0:
-                            print("\tPěší přesun")
-                        elif minutes == 0 and seconds != 0:
-                            print(f"\tPěší přesun: cca {seconds} s")
-                        elif seconds == 0:
-                            print(f"\tPěší přesun: cca {minutes} min")
-                        else:
-                            print(f"\tPěší přesun: cca {minutes} min {seconds} s")
-                    case _:
-                        print("\tPěší přesun")
-            else: # TripConnectionSegment
-                transport_type = str(segment.route.route_type).capitalize()
-                trip_name = segment.trip.get_trip_name()
-                print(f"\t{transport_type} {trip_name}")
-                print(f"\t\t{start_departure} {start_stop}")
-                print(f"\t\t{end_arrival} {end_stop}")
+            segment.display(self)
 
     def _ask_for_stop(self, prompt: str) -> tuple[str, list[str]]:
         """
@@ -209,13 +172,13 @@ class Ui:
 
         while True:
             prefix = input(prompt).strip()
-            options = dict(zip(range(1, 10), self.stop_trie.search_by_prefix(prefix))) # Get the first 9 options
+            options = list(self.stop_index.search_by_prefix(prefix, limit=9)) # Get the first 9 options
 
             if len(options) == 0:
                 print("Žádná zastávka nebyla nalezena. Zkuste vyhledávat znovu.")
 
             elif len(options) == 1:
-                name, ids = options[1]
+                name, ids = options[0]
                 print(f"Nalezena zastávka: {name}")
                 print("[Enter] pro potvrzení, [0] pro nové vyhledání")
                 command = input().strip()
@@ -226,14 +189,14 @@ class Ui:
 
             else:
                 print("Vyberte z nabídky:")
-                for i, (name, _) in options.items():
+                for i, (name, _) in enumerate(options, start=1):
                     print(f"[{i}] {name}")
                 print("[0] pro nové vyhledání")
                 command = input().strip()
                 if command == "0":
                     continue
-                if command.isdecimal() and int(command) in options:
-                    name, ids = options[int(command)]
+                if command.isdecimal() and 1 <= int(command) <= len(options):
+                    name, ids = options[int(command) - 1]
                     return name, ids
                 else:
                     print("Neznámý příkaz. Zkuste vyhledávat znovu.")
@@ -242,14 +205,19 @@ class Ui:
         """Request a datetime from the user, printing the specified prompt."""
         while True:
             string = input(prompt)
+            for datetime_format in _DATETIME_FORMATS:
+                try:
+                    return datetime.strptime(string.strip(), datetime_format)
+                except ValueError:
+                    pass
             try:
                 return parse(string, dayfirst=True)
             except ParserError:
                 print("Nesprávný formát. Zkuste zadat datum a čas znovu.")
 
-    def _format_datetime(self, dt: datetime) -> str:
+    def format_datetime(self, dt: datetime) -> str:
         """Format a datetime in a human-readable way."""
-        return f"{dt.day}. {dt.month}. {dt.year} {dt.hour}:{str(dt.minute).zfill(2)}"
+        return f"{dt.day}. {dt.month}. {dt.year} {dt.hour}:{dt.minute:02d}"
 
     def _format_timedelta(self, td: timedelta) -> str:
         """Format a timedelta in a human-readable way (as hours and minutes)."""
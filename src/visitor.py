@@ -1,103 +1,127 @@
 from __future__ import annotations
-from dataclasses import dataclass
-from datetime import date, datetime, time, timedelta
-from functools import total_ordering
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass, field
+from datetime import date
 from abc import ABC, abstractmethod
-from typing import Iterable
+from typing import ClassVar
 
 from .dataset import Dataset
 from .connection import Connection, OpenConnection
-from .structures import PickupDropoffType, Stop, StopTime, Transfer, Trip
+from .structures import (
+    SECONDS_PER_DAY, PickupDropoffType, Stop, StopDepartures, StopTime, Transfer, Trip, TripStopTimes,
+    seconds_to_datetime
+)
 
 
-MIDNIGHT = time(0, 0)
-ONE_DAY = timedelta(days=1)
-
-
-@total_ordering
 class Visitor(ABC):
     """
     An abstract class representing a location (stop, trip or transfer) that is being explored by the algorithm.
 
-    Derived classes need to implement the next_event() and next() methods.
+    Derived classes need to implement the next() method and keep event_time up to date. All times are handled
+    as numbers of seconds (see datetime_to_seconds()) and converted to datetimes only when they leave the search.
+    The priority queue is ordered by event_time and event_priority directly, so Visitors do not define any comparison
+    operators. Every Visitor is unique, so they are compared by identity.
     """
 
-    def __eq__(self, other: object) -> bool:
-        """Visitor instances are compared according to the datetime of their next event."""
-        if isinstance(other, Visitor):
-            return self.next_event() == other.next_event()
-        return NotImplemented
+    __slots__ = ()
 
-    def __lt__(self, other: Visitor) -> bool:
-        """Visitor instances are compared according to the datetime of their next event."""
-        return self.next_event() < other.next_event()
+    event_time: int
+    """
+    The time of the next event (departure for StopVisitor, arrival for TripVisitor or TransferVisitor), in seconds
+    (see datetime_to_seconds()). The priority queue is ordered according to this value.
+    """
 
-    @abstractmethod
-    def next_event(self) -> datetime:
-        """
-        Return the datetime of the next event (departure for StopVisitor, arrival for TripVisitor or TransferVisitor).
-        Visitor instances are compared according to this value.
-        """
+    event_priority: ClassVar[int]
+    """
+    Decides the order of Visitors whose next events happen at the same time - lower values are handled first.
+    Arrivals (TripVisitor and TransferVisitor) go before departures (StopVisitor), so that a departure always uses
+    the best connection to its stop, including one that arrives in the same second.
+    """
 
     @abstractmethod
-    def next(self, visited_stops: dict[str, Connection], visited_trips: dict[str, OpenConnection]) -> list[Visitor]:
+    def next(
+        self, visited_stops: dict[str, Connection], visited_trips: dict[str, OpenConnection], time_limit: int
+    ) -> tuple[bool, list[Visitor]]:
         """
-        Handle the next event (departure or arrival).
+        Handle the next event (departure or arrival) and advance this Visitor to its following event, if there is one.
 
         :param visited_stops: A dictionary with the current best Connections to all stops that have already been reached. \
         The function can mutate this dictionary.
         :param visited_trips: A dictionary with the current best OpenConnections to all trips that have already been reached. \
         The function can mutate this dictionary.
-        :returns: A list of Visitors that should be enqueued.
+        :param time_limit: The time (in seconds) after which the search does not handle any more events. Visitors \
+        whose next event would be later may be left out of the result (or report they have no more events).
+        :returns: A tuple (alive, visitors), where alive is True if this Visitor has another event and should stay \
+        enqueued, and visitors is a list of new Visitors that should be enqueued.
+        """
+
+    def arrival_stop_id(self) -> str | None:
+        """
+        Return the stop_id of the stop the next event arrives to (for TripVisitor or TransferVisitor),
+        or None if the next event is not an arrival (for StopVisitor).
         """
+        return None
 
 
-@dataclass
+@dataclass(slots=True, eq=False)
 class TripVisitor(Visitor):
     """Represents a trip that was reached by the algorithm and is currently being explored."""
 
+    event_priority: ClassVar[int] = 0
+
+    dataset: Dataset = field(repr=False)
+    """The dataset in which the search is performed."""
     trip: Trip
     """A Trip to which this visitor belongs."""
     service_day: date
     """A service day on which this trip runs."""
-    trip_stoptimes: list[StopTime]
-    """A list of all StopTimes that occur on this trip, ordered sequentially on the trip."""
+    service_day_start: int
+    """The midnight at the start of service_day in seconds, from which all times on this trip are counted."""
+    trip_stoptimes: TripStopTimes
+    """A table of all StopTimes that occur on this trip, ordered sequentially on the trip."""
     next_stoptime_idx: int
     """An index into trip_stoptimes of the next arrival to a stop."""
+    event_time: int
+    """The time of the next arrival to a stop, in seconds."""
 
     @classmethod
-    def create(cls, departure_stoptime: StopTime, service_day: date) -> TripVisitor | None:
+    def create(cls, dataset: Dataset, departure_stoptime: StopTime, service_day: date) -> TripVisitor | None:
         """
         Attempt to create a TripVisitor for a trip starting with the specified departure and running on a specified service day.
         If there are no more valid stops on the trip after the departure, do not create anything and return None.
         """
 
         visitor = cls(
-            trip=departure_stoptime.get_trip(),
+            dataset=dataset,
+            trip=dataset.get_trip_by_id(departure_stoptime.trip_id),
             service_day=service_day,
-            trip_stoptimes=[], # placeholder
+            service_day_start=service_day.toordinal() * SECONDS_PER_DAY,
+            trip_stoptimes=TripStopTimes.empty(), # placeholder
             next_stoptime_idx=-1, # placeholder
+            event_time=0, # placeholder
         )
         if not visitor._initial_find_next_stop(departure_stoptime): # No valid stop after this one
             return None
         return visitor
 
-    def next_event(self) -> datetime:
-        """Return the datetime of the next arrival to a stop."""
-        return datetime.combine(self.service_day, MIDNIGHT) + self.trip_stoptimes[self.next_stoptime_idx].arrival_time
+    def arrival_stop_id(self) -> str:
+        """Return the stop_id of the next stop on this trip."""
+        return self.trip_stoptimes.stop_ids[self.next_stoptime_idx]
 
-    def next(self, visited_stops: dict[str, Connection], visited_trips: dict[str, OpenConnection]) -> list[Visitor]:
+    def next(
+        self, visited_stops: dict[str, Connection], visited_trips: dict[str, OpenConnection], time_limit: int
+    ) -> tuple[bool, list[Visitor]]:
         """
         Handle the next arrival to a stop.
 
         If the reached stop has already been visited, update the connection in visited_stops only if the new connection
         is better than the previous one, and in that case, find all possible transfers from this stop. If the reached stop
         has not yet been visited, create a new StopVisitor for it, add the newly found connection into visited_stops and
-        find all possible transfers from this stop. Finally, find the next stop on this trip and return all new Visitors
-        (including self, if there are any more stops on this trip).
+        find all possible transfers from this stop. Finally, find the next stop on this trip and return whether there is
+        one, along with all new Visitors.
         """
 
-        next_stoptime = self.trip_stoptimes[self.next_stoptime_idx]
+        next_stoptime = self.trip_stoptimes.stop_times[self.next_stoptime_idx]
         next_stop_id = next_stoptime.stop_id
         new_connection = visited_trips[self.trip.trip_id].to_connection(next_stoptime)
         visitors_to_return: list[Visitor] = []
@@ -111,7 +135,7 @@ class TripVisitor(Visitor):
                 add_transfers = True
         else:
             # Found a new stop
-            new_stop_visitor = StopVisitor.create(next_stoptime, self.service_day)
+            new_stop_visitor = StopVisitor.create(self.dataset, next_stoptime, self.service_day)
             if new_stop_visitor is not None:
                 visitors_to_return.append(new_stop_visitor)
                 visited_stops[next_stop_id] = new_connection
@@ -119,32 +143,34 @@ class TripVisitor(Visitor):
 
         if add_transfers:
             visitors_to_return.extend(TransferVisitor.create_all(
-                next_stoptime.get_stop(),
-                self.next_event(),
-                new_connection
+                self.dataset,
+                self.dataset.get_stop_by_id(next_stop_id),
+                self.event_time,
+                new_connection,
+                visited_stops,
+                time_limit,
             ))
 
-        if self._update_next_stop():
-            # There are still more stops on this trip
-            visitors_to_return.append(self)
-
-        return visitors_to_return
+        # If there are still more stops on this trip, this Visitor stays enqueued
+        return self._update_next_stop(), visitors_to_return
 
     def _update_next_stop(self) -> bool:
         """
-        Update the next_stoptime_idx to refer to the next stop on this trip where passengers can get off.
+        Update the next_stoptime_idx and event_time to refer to the next stop on this trip where passengers can get off.
         If there is no such stop, return False. Otherwise return True.
         """
 
         index = self.next_stoptime_idx
-        trip_stoptimes_len = len(self.trip_stoptimes)
+        drop_off_types = self.trip_stoptimes.drop_off_types
+        trip_stoptimes_len = len(drop_off_types)
+        not_available = PickupDropoffType.NOT_AVAILABLE
         while True:
             index += 1
             if index >= trip_stoptimes_len: # Past the end of the list
                 return False
-            next_stoptime = self.trip_stoptimes[index]
-            if next_stoptime.drop_off_type != PickupDropoffType.NOT_AVAILABLE:
+            if drop_off_types[index] != not_available:
                 self.next_stoptime_idx = index
+                self.event_time = self.service_day_start + self.trip_stoptimes.arrival_times[index]
                 return True
 
     def _initial_find_next_stop(self, initial_stoptime: StopTime) -> bool:
@@ -152,111 +178,106 @@ class TripVisitor(Visitor):
         Should be called after creating a new TripVisitor.
 
         Gets the list of all StopTimes on this trip, searches for the index of the initial StopTime in it
-        and writes it into next_stoptime_idx. Finally calls _update_next_stop() and returns its result.
+        (using a binary search over the stop_sequence values) and writes it into next_stoptime_idx.
+        Finally calls _update_next_stop() and returns its result.
         """
 
-        self.trip_stoptimes = trip_stoptimes = self.trip.get_stop_times()
-        initial_stop_sequence = initial_stoptime.stop_sequence
-
-        start = 0
-        end = len(self.trip_stoptimes) - 1
-        middle = (start + end) // 2
-        while trip_stoptimes[middle].stop_sequence != initial_stop_sequence:
-            if trip_stoptimes[middle].stop_sequence < initial_stop_sequence:
-                start = middle + 1
-            else:
-                end = middle - 1
-            middle = (start + end) // 2
-        self.next_stoptime_idx = middle
+        self.trip_stoptimes = self.trip.get_stop_times()
+        self.next_stoptime_idx = bisect_left(self.trip_stoptimes.stop_sequences, initial_stoptime.stop_sequence)
 
         return self._update_next_stop()
 
 
-@dataclass
+@dataclass(slots=True, eq=False)
 class StopVisitor(Visitor):
     """Represents a stop that has been reached by the algorithm and is currently being explored."""
 
+    event_priority: ClassVar[int] = 1
+
+    dataset: Dataset = field(repr=False)
+    """The dataset in which the search is performed."""
     stop: Stop
     """A Stop to which this Visitor belongs."""
-    next_departure_time: datetime
-    """A datetime describing when the next departure from this stop occurs."""
-    stop_departures: list[StopTime]
-    """A list of all departures from this stop, ordered by departure time (modulo 24 hours)."""
+    stop_departures: StopDepartures
+    """A table of all departures from this stop, ordered by departure time (modulo 24 hours)."""
     next_departure_idx: int
     """An index into stop_departures of the next departure from this stop."""
+    event_time: int
+    """The time of the next departure from this stop, in seconds."""
 
     @classmethod
-    def create(cls, arrival_stoptime: StopTime, service_day: date) -> StopVisitor | None:
+    def create(cls, dataset: Dataset, arrival_stoptime: StopTime, service_day: date) -> StopVisitor | None:
         """
         Attempt to create a StopVisitor for a stop after the arrival of a trip running on a specified service day.
         If there are no more valid trips from the stop in 24 hours, do not create anything and return None.
         """
 
         visitor = cls(
-            stop=arrival_stoptime.get_stop(),
-            next_departure_time=datetime.combine(service_day, MIDNIGHT) + arrival_stoptime.arrival_time,
-            stop_departures=[], # placeholder
+            dataset=dataset,
+            stop=dataset.get_stop_by_id(arrival_stoptime.stop_id),
+            stop_departures=StopDepartures.empty(), # placeholder
             next_departure_idx=-1, # placeholder
+            event_time=service_day.toordinal() * SECONDS_PER_DAY + arrival_stoptime.arrival_time,
         )
         if not visitor._initial_find_next_departure(): # No valid departure in 24 hours
             return None
         return visitor
 
     @classmethod
-    def create_at_origin(cls, dataset: Dataset, origin_stop_id: str, start_time: datetime) -> StopVisitor | None:
+    def create_at_origin(cls, dataset: Dataset, origin_stop_id: str, start_time: int) -> StopVisitor | None:
         """
         Attempt to create a StopVisitor at the origin of the connection search, using the specified dataset and the start time
-        of the search. If there are no valid trips from the stop in 24 hours, do not create anything and return None.
+        of the search (in seconds). If there are no valid trips from the stop in 24 hours, do not create anything and return None.
         """
 
         origin_stop = dataset.get_stop_by_id(origin_stop_id)
         visitor = cls(
+            dataset=dataset,
             stop=origin_stop,
-            # We can allow finding a trip that departs exactly at the start time of the search
-            next_departure_time=start_time - timedelta(microseconds=1),
-            stop_departures=[], # placeholder
+            stop_departures=StopDepartures.empty(), # placeholder
             next_departure_idx=-1, # placeholder
+            # We can allow finding a trip that departs exactly at the start time of the search
+            event_time=start_time - 1,
         )
         if not visitor._initial_find_next_departure(): # No valid departure in 24 hours
             return None
         return visitor
 
     @classmethod
-    def create_from_transfer(cls, transfer: Transfer, transfer_arrival_time: datetime) -> StopVisitor | None:
+    def create_from_transfer(cls, dataset: Dataset, transfer: Transfer, transfer_arrival_time: int) -> StopVisitor | None:
         """
-        Attempt to create a StopVisitor at the end of the specified transfer, ending at the specified arrival time.
-        If there are no valid trips from the stop in 24 hours, do not create anything and return None.
+        Attempt to create a StopVisitor at the end of the specified transfer, ending at the specified arrival time
+        (in seconds). If there are no valid trips from the stop in 24 hours, do not create anything and return None.
         """
 
-        stop = transfer.get_to_stop()
+        stop = dataset.get_stop_by_id(transfer.to_stop_id)
         visitor = cls(
+            dataset=dataset,
             stop=stop,
-            # We can allow finding a trip that departs exactly at the arrival of the transfer
-            next_departure_time=transfer_arrival_time - timedelta(microseconds=1),
-            stop_departures=[], # placeholder
+            stop_departures=StopDepartures.empty(), # placeholder
             next_departure_idx=-1, # placeholder
+            # We can allow finding a trip that departs exactly at the arrival of the transfer
+            event_time=transfer_arrival_time - 1,
         )
         if not visitor._initial_find_next_departure(): # No valid departure in 24 hours
             return None
         return visitor
 
-    def next_event(self) -> datetime:
-        """Return the datetime of the next departure from this stop."""
-        return self.next_departure_time
-
-    def next(self, visited_stops: dict[str, Connection], visited_trips: dict[str, OpenConnection]) -> list[Visitor]:
+    def next(
+        self, visited_stops: dict[str, Connection], visited_trips: dict[str, OpenConnection], time_limit: int
+    ) -> tuple[bool, list[Visitor]]:
         """
         Handle the next departure from this stop.
 
         If the departing trip has already been visited, update the connection in visited_trips only if the new connection
         is better than the previous one. If the reached trip has not yet been visited, create a new StopVisitor for it and
-        add the newly found connection into visited_trips. Finally, find the next departure from this stop and return all
-        new Visitors (including self, if there are any departures in the next 24 hours).
+        add the newly found connection into visited_trips. Finally, find the next departure from this stop and return
+        whether there is one in the next 24 hours (and before the time limit), along with all new Visitors.
         """
 
-        next_departure = self.stop_departures[self.next_departure_idx]
+        next_departure = self.stop_departures.stop_times[self.next_departure_idx]
         next_trip_id = next_departure.trip_id
-        next_trip_service_day = (self.next_departure_time - next_departure.departure_time).date()
+        next_trip_service_day = date.fromordinal((self.event_time - next_departure.departure_time) // SECONDS_PER_DAY)
         new_connection = visited_stops[self.stop.stop_id].to_open_connection(next_departure, next_trip_service_day)
         visitors_to_return: list[Visitor] = []
 
@@ -267,113 +288,97 @@ class StopVisitor(Visitor):
                 visited_trips[next_trip_id] = new_connection
         else:
             # Found a new trip
-            new_trip_visitor = TripVisitor.create(next_departure, next_trip_service_day)
+            new_trip_visitor = TripVisitor.create(self.dataset, next_departure, next_trip_service_day)
             if new_trip_visitor is not None:
                 visitors_to_return.append(new_trip_visitor)
                 visited_trips[next_trip_id] = new_connection
 
-        if self._update_next_departure():
-            # There are still more departures from this stop
-            visitors_to_return.append(self)
-
-        return visitors_to_return
+        # If there are still more departures from this stop before the time limit, this Visitor stays enqueued
+        return self._update_next_departure(min(time_limit, self.event_time + SECONDS_PER_DAY - 1)), visitors_to_return
 
-    def _update_next_departure(self) -> bool:
+    def _update_next_departure(self, time_limit: int) -> bool:
         """
-        Update the next_departure_time and next_departure_idx to refer to the next departure from this stop which
-        passengers can get on. If there is no such departure in 24 hours, return False. Otherwise return True.
+        Update the event_time and next_departure_idx to refer to the next departure from this stop which passengers
+        can get on. If there is no such departure at or before time_limit (in seconds, less than 24 hours after
+        the current event_time), return False. Otherwise return True.
+
+        Service days are handled as ordinal numbers (see date.toordinal()) and times as seconds, so that the loops
+        do not create any date or datetime objects.
         """
 
-        index = self.next_departure_idx
-        today = self.next_departure_time.date()
-        stop_departures_len = len(self.stop_departures)
+        today = self.event_time // SECONDS_PER_DAY
+        # The time limit as a time of day, counted from the midnight at the start of today
+        today_limit = time_limit - today * SECONDS_PER_DAY
+        # Local names for everything used inside the loops, which are the hottest part of the search
+        departure_keys = self.stop_departures.departure_keys
+        departure_times = self.stop_departures.departure_times
+        # Outside of the days expanded when loading the dataset, the full service calendars are checked instead (slower)
+        service_days = (
+            self.stop_departures.service_days if self.dataset.has_expanded_service_days(today)
+            else self.stop_departures.service_calendars
+        )
 
-        while True: # Search from the next departure up until midnight
-            index += 1
-            if index >= stop_departures_len: # Past the end of list => need to search from the start again
-                break
-            next_departure = self.stop_departures[index]
-            next_departure_full_days = next_departure.departure_time // ONE_DAY
-            next_departure_service_day = today - timedelta(days=next_departure_full_days)
-            if (
-                next_departure.get_trip().runs_on_day(next_departure_service_day)
-                and next_departure.pickup_type != PickupDropoffType.NOT_AVAILABLE
-            ):
+        # Search from the next departure up until midnight, or up until the time limit if it is earlier
+        first_index = self.next_departure_idx + 1
+        if today_limit < SECONDS_PER_DAY:
+            last_index = bisect_right(departure_keys, today_limit, first_index)
+        else:
+            last_index = len(departure_keys)
+        for index in range(first_index, last_index):
+            departure_time = departure_times[index]
+            next_departure_service_day = today - departure_time // SECONDS_PER_DAY
+            if next_departure_service_day in service_days[index]:
                 self.next_departure_idx = index
-                self.next_departure_time = datetime.combine(next_departure_service_day, MIDNIGHT) + next_departure.departure_time
+                self.event_time = next_departure_service_day * SECONDS_PER_DAY + departure_time
                 return True
 
-        index = -1
-        tomorrow = today + ONE_DAY
-        time_limit = self.next_departure_time - datetime.combine(self.next_departure_time.date(), MIDNIGHT)
-
-        while True: # Search from midnight up until 24 hours after the last departure
-            index += 1
-            if index >= stop_departures_len: # Past the end of list again => no departure in the next 24 hours
-                return False
-            next_departure = self.stop_departures[index]
-            next_departure_full_days, next_departure_base_time = divmod(next_departure.departure_time, ONE_DAY)
-            if next_departure_base_time >= time_limit: # Past the 24 hour limit
-                return False
-            next_departure_service_day = tomorrow - timedelta(days=next_departure_full_days)
-            if (
-                next_departure.get_trip().runs_on_day(next_departure_service_day)
-                and next_departure.pickup_type != PickupDropoffType.NOT_AVAILABLE
-            ):
+        # Search from midnight up until the time limit - the end of this range is found by a binary search,
+        # so the loop does not need to check the limit itself
+        tomorrow = today + 1
+        for index in range(bisect_right(departure_keys, today_limit - SECONDS_PER_DAY)):
+            departure_time = departure_times[index]
+            next_departure_service_day = tomorrow - departure_time // SECONDS_PER_DAY
+            if next_departure_service_day in service_days[index]:
                 self.next_departure_idx = index
-                self.next_departure_time = datetime.combine(next_departure_service_day, MIDNIGHT) + next_departure.departure_time
+                self.event_time = next_departure_service_day * SECONDS_PER_DAY + departure_time
                 return True
 
+        # No departure before the time limit
+        return False
+
     def _initial_find_next_departure(self) -> bool:
         """
         Should be called after creating a new StopVisitor.
 
-        Searches for the first departure that is after the initial arrival (whose time is passed in next_departure_time).
-        Then calls _update_next_departure and returns its result.
+        Searches for the first departure that is after the initial arrival (whose time is passed in event_time),
+        using a binary search over the departure times modulo 24 hours. Then calls _update_next_departure with a limit
+        of 24 hours and returns its result.
         """
 
-        self.stop_departures = stop_departures = self.stop.get_departures()
-        time_to_search = self.next_departure_time - datetime.combine(self.next_departure_time.date(), MIDNIGHT)
-        stop_departures_len = len(stop_departures)
-
-        if stop_departures_len == 0:
+        self.stop_departures = self.stop.get_departures()
+        if len(self.stop_departures) == 0:
             return False
 
-        start = 0
-        end = stop_departures_len # The first departure after the initial arrival can be past the end of the list
-        middle = (start + end) // 2
-        while not (
-            # Either at the end of the list with the previous departure still before or at time_to_search...
-            (middle == stop_departures_len and stop_departures[middle - 1].departure_time % ONE_DAY <= time_to_search) or (
-                # ...or at a departure which is after time_to_search...
-                stop_departures[middle].departure_time % ONE_DAY > time_to_search and (
-                    # ...and the previous one either does not exist,...
-                    middle == 0 or
-                    # ...or it is before or at time_to_search.
-                    stop_departures[middle - 1].departure_time % ONE_DAY <= time_to_search
-                )
-            )
-        ):
-            if stop_departures[middle].departure_time % ONE_DAY <= time_to_search:
-                start = middle + 1
-            else:
-                end = middle - 1
-            middle = (start + end) // 2
-
-        self.next_departure_idx = middle - 1
-        return self._update_next_departure()
-
-
-@dataclass
+        time_to_search = self.event_time % SECONDS_PER_DAY
+        # The first departure after the initial arrival can be past the end of the list
+        self.next_departure_idx = bisect_right(self.stop_departures.departure_keys, time_to_search) - 1
+        return self._update_next_departure(self.event_time + SECONDS_PER_DAY - 1)
+
+
+@dataclass(slots=True, eq=False)
 class TransferVisitor(Visitor):
     """Represents a walking transfer from a stop that has been reached by the algorithm."""
 
+    event_priority: ClassVar[int] = 0
+
+    dataset: Dataset = field(repr=False)
+    """The dataset in which the search is performed."""
     transfer: Transfer
     """A Transfer to which this Visitor belongs."""
-    transfer_start_time: datetime
-    """The datetime when the transfer started."""
-    transfer_end_time: datetime
-    """The datetime when the transfer ends."""
+    transfer_start_time: int
+    """The time when the transfer started, in seconds."""
+    event_time: int
+    """The time when the transfer ends, in seconds."""
     connection: Connection
     """
     The best connection to the origin stop of the transfer at the time the transfer started.
@@ -383,30 +388,55 @@ class TransferVisitor(Visitor):
     """
 
     @classmethod
-    def create_all(cls, origin_stop: Stop, arrival_time: datetime, connection: Connection) -> Iterable[TransferVisitor]:
-        """Find all transfers that can be realised from a stop and create a TransferVisitor for each of them."""
-        return (cls(
+    def create_all(
+        cls,
+        dataset: Dataset,
+        origin_stop: Stop,
+        arrival_time: int,
+        connection: Connection,
+        visited_stops: dict[str, Connection],
+        time_limit: int,
+    ) -> list[TransferVisitor]:
+        """
+        Find all transfers that can be realised from a stop and create a TransferVisitor for each of them.
+
+        Transfers to stops that have already been reached by a connection at least as good as the specified one
+        are skipped. Connections in visited_stops are only ever replaced by better ones, so such a TransferVisitor
+        could never change anything when it arrives, and it is cheaper not to enqueue it at all. Transfers which
+        would arrive after the time limit (in seconds) are skipped as well, because the search would never handle them.
+        """
+
+        quality = connection.quality
+        # The result is always consumed whole, so a list is cheaper than a generator
+        return [cls(
+            dataset=dataset,
             transfer=transfer,
             transfer_start_time=arrival_time,
-            transfer_end_time=arrival_time + timedelta(seconds=transfer.transfer_time),
+            event_time=arrival_time + transfer.transfer_time,
             connection=connection
-        ) for transfer in origin_stop.get_all_transfers())
+        ) for transfer in origin_stop.get_all_transfers() if arrival_time + transfer.transfer_time <= time_limit and (
+            transfer.to_stop_id not in visited_stops or quality > visited_stops[transfer.to_stop_id].quality
+        )]
 
-    def next_event(self) -> datetime:
-        """Return the datetime of the arrival to the destination stop."""
-        return self.transfer_end_time
+    def arrival_stop_id(self) -> str:
+        """Return the stop_id of the destination stop of the transfer."""
+        return self.transfer.to_stop_id
 
-    def next(self, visited_stops: dict[str, Connection], _: dict[str, OpenConnection]) -> list[Visitor]:
+    def next(
+        self, visited_stops: dict[str, Connection], _: dict[str, OpenConnection], _time_limit: int
+    ) -> tuple[bool, list[Visitor]]:
         """
         Handle the arrival to the destination of the transfer.
 
         If the reached stop has already been visited, update the connection in visited_stops only if the new connection
         is better than the previous one. If the reached stop has not yet been visited, create a new StopVisitor for it and
         add the newly found connection into visited_stops. Do not create any new TransferVisitors (that could create an
-        infinite transfer loop).
+        infinite transfer loop). A TransferVisitor has only one event, so it never stays enqueued.
         """
 
-        new_connection = self.connection.with_transfer(self.transfer, self.transfer_start_time, self.transfer_end_time)
+        new_connection = self.connection.with_transfer(
+            self.transfer, seconds_to_datetime(self.transfer_start_time), seconds_to_datetime(self.event_time)
+        )
         target_stop_id = self.transfer.to_stop_id
 
         if target_stop_id in visited_stops:
@@ -416,9 +446,9 @@ class TransferVisitor(Visitor):
                 visited_stops[target_stop_id] = new_connection
         else:
             # Found a new stop
-            new_stop_visitor = StopVisitor.create_from_transfer(self.transfer, self.transfer_end_time)
+            new_stop_visitor = StopVisitor.create_from_transfer(self.dataset, self.transfer, self.event_time)
             if new_stop_visitor is not None:
                 visited_stops[target_stop_id] = new_connection
-                return [new_stop_visitor]
+                return False, [new_stop_visitor]
 
-        return []
+        return False, []